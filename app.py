@@ -1,9 +1,12 @@
-from flask import Flask, render_template, request
+from flask import Flask, make_response, render_template, request
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import requests
 from services.fetchers import fetch_gutenberg, fetch_wiki
 from services.processor import run_pipeline
 from services.steps import *
 from services.metrics import (
+    count_words,
     get_word_count, 
     get_unique_word_count, 
     get_character_count, 
@@ -11,12 +14,157 @@ from services.metrics import (
     get_most_frequent_words,
     get_zipf_data
 )
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from hashlib import blake2b
+from threading import BoundedSemaphore, Lock
+import multiprocessing
 import os 
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask's default JSON provider with orjson doing the encoding and decoding.
+
+    Dates, dataclasses and other non-native values still go through Flask's
+    default hook. Unlike DefaultJSONProvider, non-ASCII characters are
+    written as UTF-8 rather than escaped, and output is compact unless
+    indent=2 is asked for (as response() does in debug mode). Calls with
+    options orjson can't express, including ensure_ascii=True, fall back
+    to the stdlib implementation.
+    """
+
+    # orjson always emits UTF-8
+    ensure_ascii = False
+
+    _OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_PASSTHROUGH_DATACLASS
+                | orjson.OPT_NON_STR_KEYS)
+
+    def dumps(self, obj, **kwargs):
+        default = kwargs.pop('default', self.default)
+        sort_keys = kwargs.pop('sort_keys', self.sort_keys)
+        indent = kwargs.get('indent')
+        separators = kwargs.get('separators')
+
+        # response() passes either indent=2 or compact separators
+        if (kwargs.keys() - {'indent', 'separators', 'ensure_ascii'}
+                or kwargs.get('ensure_ascii', self.ensure_ascii)
+                or indent not in (None, 2)
+                or separators not in (None, (',', ':'))
+                or (indent and separators)):
+            return super().dumps(obj, default=default, sort_keys=sort_keys, **kwargs)
+
+        option = (self._OPTIONS
+                  | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+                  | (orjson.OPT_INDENT_2 if indent else 0))
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 APP_NAME = 'NLP visualiser'
 
+# Number of analysis results kept in memory, keyed on content hash + options
+ANALYSIS_CACHE_SIZE = 64
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = Lock()
+
+# Seconds an analysis may run in a worker before it is killed
+ANALYSIS_TIMEOUT = 60
+
+# Seconds a request may wait for a free worker before giving up
+ANALYSIS_QUEUE_TIMEOUT = 30
+
+# Worker processes for analyses; kept small since each holds a full text
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 2))
+
+ANALYSIS_TIMEOUT_ERROR = "Analysis took too long. Please try a shorter text."
+ANALYSIS_BUSY_ERROR = "The server is busy. Please try again shortly."
+ANALYSIS_FAILED_ERROR = "Analysis failed. Please try a shorter text."
+
+_executor_lock = Lock()
+
+# One slot per worker, so a submitted job starts straight away and
+# ANALYSIS_TIMEOUT measures its run time rather than time spent queued
+_analysis_slots = BoundedSemaphore(ANALYSIS_WORKERS)
+
+
+class AnalysisError(Exception):
+    """An analysis could not be completed; the message is shown to the user."""
+
+
+def new_executor():
+    """Create the analysis process pool.
+
+    Workers come from a forkserver rather than being forked from the
+    multi-threaded web server, which can deadlock.
+    """
+    return ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS,
+                               mp_context=multiprocessing.get_context('forkserver'))
+
+
+def replace_executor(executor):
+    """Swap a broken or stalled pool for a new one, unless another thread already has.
+
+    The old pool's workers are terminated so a runaway job stops using CPU;
+    any other job still running there fails with BrokenProcessPool and is
+    retried by its caller on the new pool.
+    """
+    with _executor_lock:
+        if app.extensions['executor'] is not executor:
+            return
+        app.extensions['executor'] = new_executor()
+        # ProcessPoolExecutor has no public way to kill its workers
+        for process in list(executor._processes.values()):
+            process.terminate()
+        executor.shutdown(wait=False)
+
+
+def submit_analysis(content, options):
+    """Run run_analysis in the process pool and return its results.
+
+    Raises AnalysisError if no worker frees up, the job times out, or
+    workers die on it twice; a job is retried at most once on a new pool
+    so an input that kills workers can't take down pool after pool.
+    """
+    if not _analysis_slots.acquire(timeout=ANALYSIS_QUEUE_TIMEOUT):
+        raise AnalysisError(ANALYSIS_BUSY_ERROR)
+    try:
+        for _ in range(2):
+            # Submit under the lock so the pool can't be swapped out between
+            # looking it up and handing it the job
+            try:
+                with _executor_lock:
+                    executor = app.extensions['executor']
+                    future = executor.submit(run_analysis, content, options)
+                return future.result(timeout=ANALYSIS_TIMEOUT)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed), or was terminated along
+                # with another request's runaway job
+                replace_executor(executor)
+            except TimeoutError:
+                replace_executor(executor)
+                raise AnalysisError(ANALYSIS_TIMEOUT_ERROR)
+        raise AnalysisError(ANALYSIS_FAILED_ERROR)
+    finally:
+        _analysis_slots.release()
+
+
+# CPU-bound analyses run in worker processes so request threads aren't
+# serialised on the GIL; workers are spawned on first use
+app.extensions['executor'] = new_executor()
+
+# Bump when templates or analysis output change so clients drop old ETags
+ETAG_VERSION = '1'
+
 DEFAULT_OPTIONS = {
     'remove_punctuation': True,
     'filter_alpha': False,
@@ -26,6 +174,23 @@ DEFAULT_OPTIONS = {
 }
 
 
+# Results for empty input, returned without running the pipeline
+EMPTY_RESULTS = {
+    'word_count': 0,
+    'unique_word_count': 0,
+    'char_count': 0,
+    'char_count_no_spaces': 0,
+    'chart_data': {
+        'before': {'labels': [], 'values': []},
+        'after': {'labels': [], 'values': []},
+    },
+    'zipf_data': {
+        'before': {'frequencies': '', 'labels': []},
+        'after': {'frequencies': '', 'labels': []},
+    },
+}
+
+
 def parse_options(data):
     """Parse analysis options from a request form or query args."""
     return {
@@ -38,54 +203,111 @@ def parse_options(data):
 
 
 def build_pipeline(options):
-    """Build a processing pipeline from the given options."""
-    steps = [('raw', tokenize_step)]
-
-    if options['remove_punctuation']:
-        steps.append(('cleaned_punct', remove_punctuation_step))
+    """Build a processing pipeline from the given options.
 
-    if options['filter_alpha']:
-        steps.append(('cleaned_alpha', filter_alpha_step))
+    Steps are (name, function, keep_snapshot) tuples; only the snapshots
+    read by analyze() are kept, the rest feed straight into the next step.
+    """
+    steps = [('raw', tokenize_step, False)]
 
-    if not options['case_sensitive']:
-        steps.append(('normalized', lowercase_step))
+    # Punctuation / alpha / case cleanup run as one fused pass
+    if (options['remove_punctuation'] or options['filter_alpha']
+            or not options['case_sensitive']):
+        steps.append(('normalized', create_cleanup_step(
+            remove_punctuation=options['remove_punctuation'],
+            filter_alpha=options['filter_alpha'],
+            lowercase=not options['case_sensitive'],
+        ), False))
 
     # Snapshot before stop-word removal for comparison charts
-    steps.append(('before_stop_words', lambda x: x))
+    steps.append(('before_stop_words', lambda x: x, True))
 
     if options['remove_stop_words']:
-        steps.append(('after_stop_words', remove_stop_words_step))
+        steps.append(('after_stop_words', remove_stop_words_step, False))
 
-    if options['words_to_exclude']:
-        words = options['words_to_exclude'].split(',')
-        steps.append(('final', create_exclusion_step(words)))
+    words = [w.strip() for w in options['words_to_exclude'].split(',') if w.strip()]
+    if words:
+        steps.append(('final', create_exclusion_step(words), True))
     else:
-        steps.append(('final', lambda x: x))
+        steps.append(('final', lambda x: x, True))
 
     return steps
 
 
+def hash_content(content):
+    """Hex digest identifying a text, used to key the analysis cache."""
+    return blake2b(content.encode('utf-8')).hexdigest()
+
+
+def make_etag(*parts):
+    """Build a short ETag from ETAG_VERSION and the values a page depends on."""
+    return blake2b(repr((ETAG_VERSION,) + parts).encode('utf-8'),
+                   digest_size=8).hexdigest()
+
+
 def analyze(content, options):
+    """Return all metrics and chart data, reusing cached results.
+
+    Results are keyed on a hash of the content rather than the content
+    itself, so cached entries do not keep the source texts alive.
+    Raises AnalysisError if the analysis can't be completed.
+    """
+    if not content:
+        return EMPTY_RESULTS
+
+    key = (hash_content(content),
+           tuple(sorted(options.items())))
+
+    with _analysis_cache_lock:
+        if key in _analysis_cache:
+            _analysis_cache.move_to_end(key)
+            return _analysis_cache[key]
+
+    results = submit_analysis(content, options)
+
+    with _analysis_cache_lock:
+        _analysis_cache[key] = results
+        if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+    return results
+
+
+def run_analysis(content, options):
     """Run the pipeline and return all metrics and chart data."""
     steps = build_pipeline(options)
     processed_words, snapshots = run_pipeline(content, steps)
 
+    # Count each snapshot once and share the Counter between metrics
+    before = snapshots.get('before_stop_words', [])
+    final = snapshots.get('final', [])
+    counts_before = count_words(before)
+    # Without stop-word/exclusion filtering both snapshots are the same list
+    counts_final = counts_before if final is before else count_words(final)
+
     return {
         'word_count': get_word_count(processed_words),
-        'unique_word_count': get_unique_word_count(processed_words),
+        'unique_word_count': get_unique_word_count(counts_final),
         'char_count': get_character_count(content),
         'char_count_no_spaces': get_character_count_no_spaces(content),
         'chart_data': {
-            'before': get_most_frequent_words(snapshots.get('before_stop_words', []), n=50),
-            'after': get_most_frequent_words(snapshots.get('final', []), n=50),
+            'before': get_most_frequent_words(counts_before, n=50),
+            'after': get_most_frequent_words(counts_final, n=50),
         },
         'zipf_data': {
-            'before': get_zipf_data(snapshots.get('before_stop_words', [])),
-            'after': get_zipf_data(snapshots.get('final', [])),
+            'before': get_zipf_data(counts_before),
+            'after': get_zipf_data(counts_final),
         },
     }
 
 
+@lru_cache(maxsize=16)
+def read_corpus(path, mtime):
+    """Read a corpus file; mtime is part of the cache key so edits are picked up."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
 def fetch_content(source, form):
     """Fetch text content based on the selected source.
 
@@ -147,7 +369,10 @@ def post():
     if error:
         return render_template('post.html', **ctx, error=error)
 
-    results = analyze(content, options)
+    try:
+        results = analyze(content, options)
+    except AnalysisError as e:
+        return render_template('post.html', **ctx, error=str(e))
 
     # Only send pasted text back to the textarea; Gutenberg/Wikipedia
     # content is re-fetchable from the ID/title and would otherwise
@@ -168,23 +393,45 @@ def examples():
     selected_file = request.args.get('file', files[0] if files else None)
     options = parse_options(request.args) if request.args else DEFAULT_OPTIONS.copy()
 
+    # The page depends only on the file listing, the chosen file's
+    # version and the options, so a revalidating browser can skip the work
+    mtime = None
+    if selected_file:
+        try:
+            mtime = os.path.getmtime(os.path.join(corpora_dir, selected_file))
+        except OSError:
+            pass
+    etag = make_etag(files, selected_file, mtime, sorted(options.items()))
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
     content = ""
     if selected_file:
         try:
-            with open(os.path.join(corpora_dir, selected_file),
-                      'r', encoding='utf-8') as f:
-                content = f.read()
+            path = os.path.join(corpora_dir, selected_file)
+            content = read_corpus(path, os.path.getmtime(path))
         except Exception as e:
             content = f"Error reading file: {str(e)}"
 
-    results = analyze(content, options)
+    error = None
+    try:
+        results = analyze(content, options)
+    except AnalysisError as e:
+        results, error = EMPTY_RESULTS, str(e)
 
-    return render_template('examples.html',
-                           name=APP_NAME, title="Corpora Examples",
-                           files=files, selected_file=selected_file,
-                           options=options, **results)
+    response = make_response(render_template(
+        'examples.html', name=APP_NAME, title="Corpora Examples",
+        files=files, selected_file=selected_file,
+        options=options, error=error, **results))
+    # Don't let a failed page be revalidated as if it were complete
+    if error is None:
+        response.set_etag(etag)
+    return response
 
 
 if __name__ == '__main__':
+    ensure_nltk_data()
     # port = int(os.environ.get('PORT', 1234))
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,27 +1,221 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from urllib.parse import urlencode
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# On-disk HTTP cache: one <key>.body / <key>.meta.json pair per URL+params
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         'data', 'http_cache')
+
+# Total size of cached bodies allowed before the oldest entries are evicted;
+# pruning then trims down to CACHE_PRUNE_TO so it doesn't run on every write
+CACHE_MAX_BYTES = 100 * 1024 * 1024
+CACHE_PRUNE_TO = 80 * 1024 * 1024
+
+# Running estimate of the cache size, scanned from disk on the first write
+_cache_bytes = None
+_cache_lock = threading.Lock()
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 30)
+
+# Shared session so repeat fetches reuse keep-alive connections, with
+# retries for transient upstream failures
+_session = requests.Session()
+_session.headers['User-Agent'] = 'MyZipfVisualizerBot/1.0'
+_session.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+
+def _read_meta(meta_path):
+    """Read a cache entry's validators; a missing or corrupt entry counts as a miss."""
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+def _read_body(body_path):
+    """Read a cached body, or None if it has gone missing."""
+    try:
+        with open(body_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _atomic_write(path, data):
+    """Write bytes to path via a temp file in CACHE_DIR so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _scan_cache():
+    """Return (mtime, size, meta_path, body_path) for every cache entry."""
+    entries = []
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return entries
+
+    for name in names:
+        if not name.endswith('.meta.json'):
+            continue
+        meta_path = os.path.join(CACHE_DIR, name)
+        body_path = meta_path[:-len('.meta.json')] + '.body'
+        try:
+            mtime = os.path.getmtime(meta_path)
+            size = os.path.getsize(body_path) + os.path.getsize(meta_path)
+        except OSError:
+            continue
+        entries.append((mtime, size, meta_path, body_path))
+    return entries
+
+
+def _prune_cache(entries):
+    """Evict least recently used entries until under CACHE_PRUNE_TO; returns the new total."""
+    total = sum(size for _, size, _, _ in entries)
+    for _, size, meta_path, body_path in sorted(entries):
+        if total <= CACHE_PRUNE_TO:
+            break
+        for path in (meta_path, body_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+    return total
+
+
+def _record_cache_write(nbytes):
+    """Account for a cache write and prune once the cache exceeds CACHE_MAX_BYTES."""
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            entries = _scan_cache()
+            _cache_bytes = sum(size for _, size, _, _ in entries)
+        else:
+            entries = None
+            # Overwrites are double-counted, which only makes pruning start early
+            _cache_bytes += nbytes
+
+        if _cache_bytes > CACHE_MAX_BYTES:
+            _cache_bytes = _prune_cache(entries if entries is not None else _scan_cache())
+
+
+def _cached_get(url, params=None, headers=None):
+    """GET a URL, revalidating against the on-disk cache.
+
+    The previous ETag / Last-Modified are sent as conditional headers so an
+    unchanged resource comes back as a body-less 304 and is served from disk.
+    Returns the response body as bytes.
+    """
+    key = hashlib.sha1((url + urlencode(params or {})).encode('utf-8')).hexdigest()
+    body_path = os.path.join(CACHE_DIR, f"{key}.body")
+    meta_path = os.path.join(CACHE_DIR, f"{key}.meta.json")
+
+    headers = dict(headers or {})
+    conditional = dict(headers)
+    meta = _read_meta(meta_path) if os.path.exists(body_path) else {}
+    if meta.get('etag'):
+        conditional['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        conditional['If-Modified-Since'] = meta['last_modified']
+
+    response = _session.get(url, params=params, headers=conditional, timeout=TIMEOUT)
+
+    if response.status_code == 304:
+        body = _read_body(body_path)
+        if body is not None:
+            # Bump the entry's mtime so pruning evicts least recently used first
+            try:
+                os.utime(meta_path)
+            except OSError:
+                pass
+            return body
+        # The cached body vanished after we sent validators; fetch it in full
+        response = _session.get(url, params=params, headers=headers, timeout=TIMEOUT)
+
+    response.raise_for_status()
+    body = response.content
+
+    # Only cache responses the server lets us revalidate
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Body first, so a meta file never points at a body older than itself
+        meta_bytes = json.dumps(
+            {'url': url, 'etag': etag, 'last_modified': last_modified}).encode('utf-8')
+        _atomic_write(body_path, body)
+        _atomic_write(meta_path, meta_bytes)
+        _record_cache_write(len(body) + len(meta_bytes))
+
+    return body
+
+
+def strip_gutenberg_boilerplate(text: str) -> str:
+    """Slice out the book between the '*** START OF' / '*** END OF' markers.
+
+    Returns the text unchanged if either marker is missing.
+    """
+    start = text.find('*** START OF')
+    end = text.rfind('*** END OF')
+    if start == -1 or end == -1 or end < start:
+        return text
+
+    # The START marker line ends with its own "***"; skip the whole line
+    body_start = text.find('\n', start)
+    if body_start == -1 or body_start > end:
+        return text
+    return text[body_start + 1:end]
+
 
 def fetch_gutenberg(bookid : int):
     url = f"https://www.gutenberg.org/files/{bookid}/{bookid}-0.txt"
-    response = requests.get(url)
-    response.raise_for_status()
-    return response.text
+    # The "-0" files are Gutenberg's UTF-8 editions; requests' default
+    # Accept-Encoding already negotiates compression for the transfer
+    text = _cached_get(url).decode('utf-8', errors='replace')
+    return strip_gutenberg_boilerplate(text)
 
 
 def fetch_wiki(title: str) -> str:
     """Fetch the plain-text extract of a Wikipedia article by title."""
     url = "https://en.wikipedia.org/w/api.php"
-    headers = {'User-Agent' : 'MyZipfVisualizerBot/1.0'}
+    # TextExtracts only returns one full-article extract per call, so
+    # titles cannot be pipe-batched here
     params = {
         "action": "query",
         "titles": title,
         "prop": "extracts",
         "explaintext": True,
+        # Resolve redirects server-side so the extract comes back in one call
+        "redirects": 1,
         "format": "json",
     }
-    response = requests.get(url, params=params, headers=headers)
-    response.raise_for_status()
-
-    data = response.json()
+    data = orjson.loads(_cached_get(url, params=params))
     pages = data.get("query", {}).get("pages", {})
 
     # The API returns pages keyed by page ID; "-1" means not found
@@ -39,4 +233,3 @@ if __name__ == "__main__":
         print(content[:500])
     except Exception as e:
         print(f"error: {e}")
-
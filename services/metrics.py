@@ -1,46 +1,58 @@
 # Output File for the final metrics
+import base64
 from collections import Counter
+from heapq import nlargest
+from operator import itemgetter
+
+import numpy as np
+
+# ASCII characters for which str.isspace() is true
+_ASCII_WHITESPACE = bytes(c for c in range(128) if chr(c).isspace())
 
 def get_word_count(words):
     """Returns total number of words."""
     return len(words)
 
-def get_unique_word_count(words):
-    """Returns number of unique words."""
-    return len(set(words))
+def count_words(words):
+    """Returns a Counter of word frequencies, shared by the metrics below."""
+    return Counter(words)
+
+def get_unique_word_count(counts):
+    """Returns number of unique words from a word Counter."""
+    return len(counts)
 
-def get_most_frequent_words(words, n=None):
-    """Returns the n most frequent words in a format suitable for charts."""
-    counts = Counter(words).most_common(n)
+def get_most_frequent_words(counts, n=None):
+    """Returns the n most frequent words from a word count mapping in a format suitable for charts."""
+    if n is None:
+        counts = sorted(counts.items(), key=itemgetter(1), reverse=True)
+    else:
+        # O(V log n) selection rather than sorting the whole vocabulary
+        counts = nlargest(n, counts.items(), key=itemgetter(1))
     return {
         "labels": [word for word, count in counts],
         "values": [count for word, count in counts]
     }
 
-def get_zipf_data(words):
+def get_zipf_data(counts):
     """
-    Returns data for Zipf's Law plot (Rank vs Frequency).
-    Includes theoretical Zipf values for comparison.
+    Returns data for Zipf's Law plot (Rank vs Frequency) from a word Counter.
+    Frequencies are sent as base64-encoded little-endian uint32s, sorted by
+    rank; the page derives ranks and the theoretical Zipf curve from them.
     """
-    if not words:
-        return {"ranks": [], "frequencies": [], "labels": [], "theoretical": []}
+    if not counts:
+        return {"frequencies": "", "labels": []}
     
-    counts = Counter(words).most_common()
-    
-    # Extract frequencies and words
-    frequencies = [count for word, count in counts]
-    labels = [word for word, count in counts]
-    ranks = list(range(1, len(frequencies) + 1))
-    
-    # Theoretical Zipf: f = C / r^s, here s=1 and C = max frequency
-    max_freq = frequencies[0]
-    theoretical = [max_freq / r for r in ranks]
+    words = np.array(list(counts), dtype=object)
+    frequencies = np.fromiter(counts.values(), dtype=np.int64, count=len(words))
+
+    # Stable sort keeps ties in first-seen order, matching Counter.most_common()
+    order = np.argsort(-frequencies, kind="stable")
+    frequencies = frequencies[order]
+    labels = words[order].tolist()
     
     return {
-        "ranks": ranks,
-        "frequencies": frequencies,
-        "labels": labels,
-        "theoretical": theoretical
+        "frequencies": base64.b64encode(frequencies.astype("<u4").tobytes()).decode("ascii"),
+        "labels": labels
     }
 
 def get_character_count(text):
@@ -49,4 +61,7 @@ def get_character_count(text):
 
 def get_character_count_no_spaces(text):
     """Returns total number of characters in raw text excluding whitespace."""
+    if text.isascii():
+        # One C-level pass deleting the bytes str.split() treats as whitespace
+        return len(text.encode('ascii').translate(None, _ASCII_WHITESPACE))
     return len("".join(text.split()))
@@ -4,16 +4,17 @@ def run_pipeline(text, steps):
     """
     Orchestrates the text processing pipeline and tracks intermediate states.
     :param text: Raw input string
-    :param steps: List of tuples (name, function)
+    :param steps: List of tuples (name, function, keep_snapshot); only steps
+                  with keep_snapshot set are recorded in snapshots
     :return: Tuple of (final_data, snapshots)
     """
     data = text
     snapshots = {}
     
     # Apply each step in the pipeline
-    for name, step_func in steps:
+    for name, step_func, keep_snapshot in steps:
         data = step_func(data)
-        if name:
+        if keep_snapshot:
             snapshots[name] = data
             
     return data, snapshots
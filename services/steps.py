@@ -2,12 +2,34 @@ import re
 import nltk
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
-nltk.download('punkt_tab')
-nltk.download('stopwords')
 # Steps for the text analysis (filtering, cleaning, etc.)
 # Each step should ideally take a list of words and return a list of words.
 
 import string
+from functools import cache
+
+# Translation table that deletes ASCII punctuation, built once
+_PUNCT_TABLE = str.maketrans('', '', string.punctuation)
+
+# Character classes for the alpha / alphanumeric filters, compiled once
+_NON_ALPHA = re.compile(r"[^a-zA-Z']")
+_NON_ALPHANUMERIC = re.compile(r"[^a-zA-Z0-9']")
+
+# NLTK resources the steps rely on, as (resource path, package name)
+_NLTK_RESOURCES = [('tokenizers/punkt_tab', 'punkt_tab'),
+                   ('corpora/stopwords', 'stopwords')]
+
+def ensure_nltk_data():
+    """Download the NLTK resources the steps need, skipping any already installed.
+
+    Called once at server start-up rather than on import, so analysis
+    worker processes importing this module don't re-run the downloads.
+    """
+    for path, package in _NLTK_RESOURCES:
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            nltk.download(package)
 
 def tokenize_step(text):
     """Converts raw text into a list of tokens using NLTK."""
@@ -15,8 +37,7 @@ def tokenize_step(text):
 
 def remove_punctuation_step(words):
     """Removes punctuation from each word in the list."""
-    table = str.maketrans('', '', string.punctuation)
-    stripped = [w.translate(table) for w in words]
+    stripped = [w.translate(_PUNCT_TABLE) for w in words]
     # Filter out empty strings that were just punctuation
     return [w for w in stripped if w]
 
@@ -27,22 +48,50 @@ def lowercase_step(words):
 def filter_alpha_step(words):
     """Removes non-alphabetic characters except apostrophes."""
     # We apply this to each word in the list
-    cleaned = [re.sub(r"[^a-zA-Z']", '', w) for w in words]
+    cleaned = [_NON_ALPHA.sub('', w) for w in words]
     # Filter out any resulting empty strings
     return [w for w in cleaned if w]
 
 def filter_alphanumeric_step(words):
     """Removes non-alphanumeric characters except apostrophes."""
-    cleaned = [re.sub(r"[^a-zA-Z0-9']", '', w) for w in words]
+    cleaned = [_NON_ALPHANUMERIC.sub('', w) for w in words]
     return [w for w in cleaned if w]
 
+def create_cleanup_step(remove_punctuation=False, filter_alpha=False, lowercase=False):
+    """
+    Fuses punctuation removal, alpha filtering and lowercasing into one pass,
+    so the token list is rebuilt once instead of once per cleanup step.
+    """
+    def cleanup_step(words):
+        cleaned = []
+        for w in words:
+            if remove_punctuation:
+                w = w.translate(_PUNCT_TABLE)
+                if not w:
+                    continue
+            if filter_alpha:
+                w = _NON_ALPHA.sub('', w)
+                if not w:
+                    continue
+            if lowercase:
+                w = w.lower()
+            cleaned.append(w)
+        return cleaned
+
+    return cleanup_step
+
+@cache
+def _english_stop_words():
+    """Loads the NLTK english stop words once and caches them as a frozenset."""
+    return frozenset(stopwords.words('english'))
+
 def remove_stop_words_step(words):
     """Removes common english stop words (based on nltk library)"""
-    stop_words = set(stopwords.words('english'))
-    return [w for w in words if w.lower() not in stop_words]
+    is_stop_word = _english_stop_words().__contains__
+    return [w for w in words if not is_stop_word(w.lower())]
 
 def create_exclusion_step(words_to_exclude):
-    exclusion_set = set(w.lower() for w in words_to_exclude)
+    exclusion_set = frozenset(w.strip().lower() for w in words_to_exclude if w.strip())
     
     def filter_step(words):
         return [w for w in words if w.lower() not in exclusion_set]